@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 BOT_PROMPTS = {
     "delhi_mentor_male": """
           #Instructions:
@@ -3064,17 +3066,46 @@ MOOD_PROACTIVE_TEMPLATES = {
         "romantic_female": "Such a sweet song! Who comes to your mind? 🎶💖",
     }
 }
+TEXT_GENERATION_STYLES = ["creative", "formal", "casual", "academic", "poetic"]
+
+# Persona prompts and style prefixes are static, so build them once at import
+# instead of formatting them on every request.
+_PROMPT_CACHE = {}
+for _bot_id in BOT_PROMPTS:
+    _culture, _persona = _bot_id.split("_")[:2]
+    _PROMPT_CACHE[(_persona, _culture)] = f"{_persona} persona with {_culture} culture"
+
+_STYLE_PREFIX = {style: f"[{style.upper()}] " for style in TEXT_GENERATION_STYLES}
+
+_ALL_PERSONAS = list(BOT_PROMPTS.keys())
+_ALL_CULTURES = list(dict.fromkeys(key.split('_')[0] for key in BOT_PROMPTS if len(key.split('_')) >= 2))
+
+_COMBINATIONS = [
+    {
+        "persona": persona,
+        "culture": culture,
+        "persona_name": persona.title(),
+        "culture_name": culture.title(),
+        "description": f"{persona.title()} persona with {culture.title()} cultural background",
+    }
+    for persona, culture in _PROMPT_CACHE
+]
+
 def get_bot_prompt(bot_id):
     """
     Fetches the bot prompt for a given bot_id.
     """
     return BOT_PROMPTS.get(bot_id, "Bot prompt not found.")
 
+@lru_cache(maxsize=256)
 def get_persona_prompt(persona, culture):
     """
     Fetches the persona prompt for a given persona and culture.
     """
-    return f"{persona} persona with {culture} culture"
+    prompt = _PROMPT_CACHE.get((persona, culture))
+    if prompt is None:
+        prompt = f"{persona} persona with {culture} culture"
+    return prompt
 
 def get_proactive_response(mood, persona_key):
     """
@@ -3086,20 +3117,33 @@ def get_all_personas():
     """
     Returns a list of all persona keys available in BOT_PROMPTS.
     """
-    return list(BOT_PROMPTS.keys())
+    return list(_ALL_PERSONAS)
 
 def get_all_cultures():
     """
     Returns a list of all unique cultures used in BOT_PROMPTS keys.
     """
-    cultures = set()
-    for key in BOT_PROMPTS.keys():
-        parts = key.split('_')
-        if len(parts) >= 2:
-            cultures.add(parts[0])
-    return list(cultures)
+    return list(_ALL_CULTURES)
+
+
+def get_text_generation_styles():
+    """
+    Returns a list of all supported text generation styles.
+    """
+    return list(TEXT_GENERATION_STYLES)
+
+@lru_cache(maxsize=2048)
 def get_text_generation_prompt(prompt, style="creative"):
     """
     Returns a formatted prompt for text generation based on the style.
     """
-    return f"[{style.upper()}] {prompt}"
+    prefix = _STYLE_PREFIX.get(style)
+    if prefix is None:
+        prefix = f"[{style.upper()}] "
+    return prefix + prompt
+
+def get_persona_culture_combinations():
+    """
+    Returns all valid persona-culture combinations.
+    """
+    return _COMBINATIONS
@@ -3,40 +3,82 @@ FastAPI backend for the LLM chat application.
 Provides endpoints for chat responses and text generation using Gemma model.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncGenerator, AsyncIterator
+from collections import OrderedDict
+import atexit
+import hashlib
+import json
 import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
 from contextlib import asynccontextmanager
+from cachetools import TTLCache, cached
+import msgspec
+import orjson
 import uvicorn
 
-from gemma_handler import GemmaHandler
+from gemma_handler import create_handler
+from inference_scheduler import InferenceScheduler
 from bot_prompts import (
     get_persona_prompt, 
     get_all_personas, 
     get_all_cultures,
+    get_persona_culture_combinations,
     get_text_generation_prompt,
+    get_text_generation_styles,
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging: request handlers only enqueue records, a background
+# listener thread formats them and writes to stderr.
+_log_queue = queue.Queue(-1)
+_log_queue_handler = QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
+_log_listener = QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Global model handler
 gemma_handler = None
+# Set only by lifespan and /reload-model; request handlers check this instead of gemma_handler.is_loaded()
+_MODEL_READY = False
+
+_PERSONA_CULTURE_PAIRS = [(c["persona"], c["culture"]) for c in get_persona_culture_combinations()]
+
+# Batches concurrent /chat and /generate requests onto the single inference thread
+_scheduler: Optional[InferenceScheduler] = None
+
+@cached(TTLCache(maxsize=1, ttl=0.5))
+def _cached_model_info() -> Dict[str, Any]:
+    """gemma_handler.get_model_info(), cached for 500ms since /health is polled frequently."""
+    return gemma_handler.get_model_info()
+
+# LRU cache of chat responses keyed by (persona, culture, message, history digest)
+_CHAT_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+_CHAT_CACHE_MAXSIZE = 1024
+
+def _chat_cache_key(persona: str, culture: str, message: str, history: List[Dict[str, str]]) -> tuple:
+    """Build the chat cache key, hashing the history so keys stay small."""
+    history_digest = hashlib.blake2b(json.dumps(history).encode(), digest_size=16).hexdigest()
+    return (persona, culture, message, history_digest)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage the application lifespan - load model on startup, cleanup on shutdown."""
-    global gemma_handler
+    global gemma_handler, _scheduler, _MODEL_READY
     
     # Startup
     logger.info("Starting up LLM Chat API...")
-    gemma_handler = GemmaHandler()
+    gemma_handler = create_handler()
     
     # Load the model
     if not gemma_handler.load_model():
@@ -44,94 +86,141 @@ async def lifespan(app: FastAPI):
         raise RuntimeError("Could not load the LLM model")
     
     logger.info("LLM model loaded successfully")
+    gemma_handler.build_prefix_cache(_PERSONA_CULTURE_PAIRS)
+    gemma_handler.warmup()
+    _scheduler = InferenceScheduler(gemma_handler)
+    _scheduler.start()
+    _MODEL_READY = True
     yield
     
     # Shutdown
     logger.info("Shutting down LLM Chat API...")
+    _MODEL_READY = False
+    _scheduler.stop()
     if gemma_handler:
-        gemma_handler.unload_model()
+        gemma_handler.unload_model(hard=True)
 
 # Create FastAPI app
 app = FastAPI(
     title="LLM Chat API",
     description="A multi-persona chat API using Gemma LLM with cultural variations",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://localhost:5173", "http://127.0.0.1:3000", "http://127.0.0.1:5173"],
+    allow_origin_regex=r"^https?://(localhost|127\.0\.0\.1):(3000|5173)$",
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Pydantic models for request/response
-class ChatMessage(BaseModel):
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """Log any unhandled endpoint error and return it as a JSON 500."""
+    logger.error("Error handling %s: %s", request.url.path, exc)
+    return ORJSONResponse(status_code=500, content={"detail": str(exc)})
+
+# msgspec structs for the hot chat/generate request and response bodies
+class ChatMessage(msgspec.Struct, frozen=True, gc=False):
     role: str  # "user" or "assistant"
     content: str
     timestamp: Optional[str] = None
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct):
     message: str
     persona: str = "friend"
     culture: str = "delhi"
     conversation_history: Optional[List[ChatMessage]] = []
 
-class ChatResponse(BaseModel):
+class ChatResponse(msgspec.Struct):
     response: str
     persona: str
     culture: str
     success: bool
     error_message: Optional[str] = None
 
-class TextGenerationRequest(BaseModel):
+class TextGenerationRequest(msgspec.Struct):
     prompt: str
     style: str = "creative"
     max_tokens: int = 512
 
-class TextGenerationResponse(BaseModel):
+class TextGenerationResponse(msgspec.Struct):
     generated_text: str
     style: str
     success: bool
     error_message: Optional[str] = None
 
-class PersonaInfo(BaseModel):
-    persona: str
-    culture: str
-    persona_name: str
-    culture_name: str
-    description: str
+_chat_request_decoder = msgspec.json.Decoder(ChatRequest)
+_text_generation_request_decoder = msgspec.json.Decoder(TextGenerationRequest)
 
+async def parse_chat_request(request: Request) -> ChatRequest:
+    """Decode a /chat request body with msgspec."""
+    try:
+        return _chat_request_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def parse_text_generation_request(request: Request) -> TextGenerationRequest:
+    """Decode a /generate request body with msgspec."""
+    try:
+        return _text_generation_request_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def _msgspec_response(content: msgspec.Struct) -> Response:
+    """Encode a msgspec struct straight to a JSON response."""
+    return Response(msgspec.json.encode(content), media_type="application/json")
+
+async def _sse_events(chunks: AsyncGenerator[str, None]) -> AsyncIterator[bytes]:
+    """Wrap generated text chunks as server-sent events, ending with [DONE] and stopping generation on disconnect."""
+    try:
+        async for chunk in chunks:
+            yield b"data: " + orjson.dumps({"text": chunk}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+    finally:
+        await chunks.aclose()
+
+# Pydantic model for the /model-info response
 class ModelInfo(BaseModel):
     model_name: str
     device: str
     is_loaded: bool
     cuda_available: bool
 
+# Static responses, serialized once at import instead of on every request
+_ROOT_JSON = orjson.dumps({
+    "message": "LLM Chat API with Multiple Personas",
+    "version": "1.0.0",
+    "endpoints": {
+        "chat": "/chat",
+        "chat_stream": "/chat/stream",
+        "generate": "/generate",
+        "generate_stream": "/generate/stream",
+        "personas": "/personas",
+        "cultures": "/cultures",
+        "combinations": "/combinations",
+        "styles": "/styles",
+        "health": "/health"
+    }
+})
+_PERSONAS_JSON = orjson.dumps({"personas": get_all_personas(), "success": True})
+_CULTURES_JSON = orjson.dumps({"cultures": get_all_cultures(), "success": True})
+_COMBINATIONS_JSON = orjson.dumps(get_persona_culture_combinations())
+_STYLES_JSON = orjson.dumps({"styles": get_text_generation_styles(), "success": True})
+
 # API Endpoints
 
 @app.get("/")
 async def root():
     """Root endpoint with API information."""
-    return {
-        "message": "LLM Chat API with Multiple Personas",
-        "version": "1.0.0",
-        "endpoints": {
-            "chat": "/chat",
-            "generate": "/generate",
-            "personas": "/personas",
-            "cultures": "/cultures",
-            "combinations": "/combinations",
-            "styles": "/styles",
-            "health": "/health"
-        }
-    }
+    return Response(_ROOT_JSON, media_type="application/json")
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@app.post("/chat")
+async def chat(request: ChatRequest = Depends(parse_chat_request)):
     """
     Generate a chat response based on persona and culture.
     
@@ -142,48 +231,52 @@ async def chat(request: ChatRequest):
         ChatResponse with the generated response
     """
     try:
-        if not gemma_handler or not gemma_handler.is_loaded():
+        if not _MODEL_READY:
             raise HTTPException(status_code=503, detail="Model not loaded")
         
         # Convert conversation history to the format expected by gemma_handler
-        history = []
-        if request.conversation_history:
-            for msg in request.conversation_history:
-                history.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        # Generate response
-        response = gemma_handler.chat_response(
-            message=request.message,
-            persona=request.persona,
-            culture=request.culture,
-            conversation_history=history
-        )
+        history = [{"role": msg.role, "content": msg.content} for msg in request.conversation_history or []]
         
-        if response is None:
-            raise HTTPException(status_code=500, detail="Failed to generate response")
+        cache_key = _chat_cache_key(request.persona, request.culture, request.message, history)
+        response = _CHAT_CACHE.get(cache_key)
+        if response is not None:
+            _CHAT_CACHE.move_to_end(cache_key)
+        else:
+            # Generate response
+            response = await _scheduler.submit(
+                "chat",
+                message=request.message,
+                persona=request.persona,
+                culture=request.culture,
+                conversation_history=history
+            )
+            
+            if response is None:
+                raise HTTPException(status_code=500, detail="Failed to generate response")
+            
+            _CHAT_CACHE[cache_key] = response
+            if len(_CHAT_CACHE) > _CHAT_CACHE_MAXSIZE:
+                _CHAT_CACHE.popitem(last=False)
         
-        return ChatResponse(
+        return _msgspec_response(ChatResponse(
             response=response,
             persona=request.persona,
             culture=request.culture,
             success=True
-        )
+        ))
         
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
-        return ChatResponse(
+        logger.error("Error in chat endpoint: %s", e)
+        return _msgspec_response(ChatResponse(
             response="",
             persona=request.persona,
             culture=request.culture,
             success=False,
             error_message=str(e)
-        )
+        ))
 
-@app.post("/generate", response_model=TextGenerationResponse)
-async def generate_text(request: TextGenerationRequest):
+@app.post("/generate")
+async def generate_text(request: TextGenerationRequest = Depends(parse_text_generation_request)):
     """
     Generate text based on a prompt and style.
     
@@ -194,11 +287,12 @@ async def generate_text(request: TextGenerationRequest):
         TextGenerationResponse with the generated text
     """
     try:
-        if not gemma_handler or not gemma_handler.is_loaded():
+        if not _MODEL_READY:
             raise HTTPException(status_code=503, detail="Model not loaded")
         
         # Generate text
-        generated_text = gemma_handler.generate_text(
+        generated_text = await _scheduler.submit(
+            "generate",
             prompt=request.prompt,
             style=request.style,
             max_tokens=request.max_tokens
@@ -207,60 +301,87 @@ async def generate_text(request: TextGenerationRequest):
         if generated_text is None:
             raise HTTPException(status_code=500, detail="Failed to generate text")
         
-        return TextGenerationResponse(
+        return _msgspec_response(TextGenerationResponse(
             generated_text=generated_text,
             style=request.style,
             success=True
-        )
+        ))
         
     except Exception as e:
-        logger.error(f"Error in generate endpoint: {str(e)}")
-        return TextGenerationResponse(
+        logger.error("Error in generate endpoint: %s", e)
+        return _msgspec_response(TextGenerationResponse(
             generated_text="",
             style=request.style,
             success=False,
             error_message=str(e)
-        )
+        ))
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest = Depends(parse_chat_request)):
+    """
+    Stream a chat response as server-sent events, one event per generated chunk.
+    
+    Args:
+        request: ChatRequest containing message, persona, culture, and conversation history
+        
+    Returns:
+        StreamingResponse of `data: {"text": ...}` events terminated by `data: [DONE]`
+    """
+    if not _MODEL_READY:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    history = [{"role": msg.role, "content": msg.content} for msg in request.conversation_history or []]
+    
+    chunks = _scheduler.stream(
+        "chat",
+        message=request.message,
+        persona=request.persona,
+        culture=request.culture,
+        conversation_history=history
+    )
+    return StreamingResponse(_sse_events(chunks), media_type="text/event-stream")
+
+@app.post("/generate/stream")
+async def generate_text_stream(request: TextGenerationRequest = Depends(parse_text_generation_request)):
+    """
+    Stream generated text as server-sent events, one event per generated chunk.
+    
+    Args:
+        request: TextGenerationRequest containing prompt, style, and max_tokens
+        
+    Returns:
+        StreamingResponse of `data: {"text": ...}` events terminated by `data: [DONE]`
+    """
+    if not _MODEL_READY:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    chunks = _scheduler.stream(
+        "generate",
+        prompt=request.prompt,
+        style=request.style,
+        max_tokens=request.max_tokens
+    )
+    return StreamingResponse(_sse_events(chunks), media_type="text/event-stream")
 
 @app.get("/personas")
 async def get_personas():
     """Get all available personas."""
-    try:
-        personas = get_all_personas()
-        return {"personas": personas, "success": True}
-    except Exception as e:
-        logger.error(f"Error getting personas: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(_PERSONAS_JSON, media_type="application/json")
 
 @app.get("/cultures")
 async def get_cultures():
     """Get all available cultures."""
-    try:
-        cultures = get_all_cultures()
-        return {"cultures": cultures, "success": True}
-    except Exception as e:
-        logger.error(f"Error getting cultures: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(_CULTURES_JSON, media_type="application/json")
 
-@app.get("/combinations", response_model=List[PersonaInfo])
+@app.get("/combinations")
 async def get_combinations():
     """Get all valid persona-culture combinations."""
-    try:
-        combinations = get_persona_culture_combinations()
-        return combinations
-    except Exception as e:
-        logger.error(f"Error getting combinations: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(_COMBINATIONS_JSON, media_type="application/json")
 
 @app.get("/styles")
 async def get_styles():
     """Get all available text generation styles."""
-    try:
-        styles = get_text_generation_styles()
-        return {"styles": styles, "success": True}
-    except Exception as e:
-        logger.error(f"Error getting styles: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return Response(_STYLES_JSON, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
@@ -273,7 +394,7 @@ async def health_check():
                 "model_loaded": False
             }
         
-        model_info = gemma_handler.get_model_info()
+        model_info = _cached_model_info()
         
         return {
             "status": "healthy" if model_info["is_loaded"] else "unhealthy",
@@ -282,7 +403,7 @@ async def health_check():
         }
         
     except Exception as e:
-        logger.error(f"Error in health check: {str(e)}")
+        logger.error("Error in health check: %s", e)
         return {
             "status": "unhealthy",
             "message": str(e),
@@ -292,60 +413,63 @@ async def health_check():
 @app.get("/model-info", response_model=ModelInfo)
 async def get_model_info():
     """Get information about the loaded model."""
-    try:
-        if not gemma_handler:
-            raise HTTPException(status_code=503, detail="Model handler not initialized")
-        
-        info = gemma_handler.get_model_info()
-        return ModelInfo(**info)
-        
-    except Exception as e:
-        logger.error(f"Error getting model info: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if not gemma_handler:
+        raise HTTPException(status_code=503, detail="Model handler not initialized")
+    
+    info = _cached_model_info()
+    return ModelInfo(**info)
 
 # Additional utility endpoints
 
 @app.post("/reload-model")
 async def reload_model():
     """Reload the Gemma model (useful for debugging)."""
-    try:
-        global gemma_handler
-        
-        if gemma_handler:
-            gemma_handler.unload_model()
-        
-        gemma_handler = GemmaHandler()
-        
-        if not gemma_handler.load_model():
-            raise HTTPException(status_code=500, detail="Failed to reload model")
-        
-        return {"message": "Model reloaded successfully", "success": True}
-        
-    except Exception as e:
-        logger.error(f"Error reloading model: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    global _MODEL_READY
+    
+    _MODEL_READY = False
+    _CHAT_CACHE.clear()
+    _cached_model_info.cache_clear()
+    # Swap handlers on the inference thread, after any batch or stream already running
+    if not await _scheduler.run(_reload_handler):
+        raise HTTPException(status_code=500, detail="Failed to reload model")
+    _cached_model_info.cache_clear()
+    _MODEL_READY = True
+    
+    return {"message": "Model reloaded successfully", "success": True}
+
+def _reload_handler() -> bool:
+    """Unload the current model, then load, prefill and warm up a new handler for the scheduler."""
+    global gemma_handler
+    if gemma_handler:
+        gemma_handler.unload_model(hard=True)
+    gemma_handler = create_handler()
+    _scheduler.handler = gemma_handler
+    if not gemma_handler.load_model():
+        return False
+    gemma_handler.build_prefix_cache(_PERSONA_CULTURE_PAIRS)
+    gemma_handler.warmup()
+    return True
 
 @app.get("/test-persona/{persona}/{culture}")
 async def test_persona(persona: str, culture: str):
     """Test a specific persona-culture combination with a sample prompt."""
-    try:
-        prompt = get_persona_prompt(persona, culture)
-        return {
-            "persona": persona,
-            "culture": culture,
-            "prompt": prompt,
-            "success": True
-        }
-    except Exception as e:
-        logger.error(f"Error testing persona: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    prompt = get_persona_prompt(persona, culture)
+    return {
+        "persona": persona,
+        "culture": culture,
+        "prompt": prompt,
+        "success": True
+    }
 
 # Run the application
 if __name__ == "__main__":
+    # Each worker loads its own model copy, so only raise WORKERS with memory to spare.
     uvicorn.run(
         "gemma_api:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop has no Windows build
+        http="httptools",
+        workers=int(os.environ.get("WORKERS", 1)),
         log_level="info"
     )
@@ -1,83 +1,368 @@
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, QuantizedCache, StaticCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Iterable, Iterator, List, Tuple, Union
+from threading import Event, Lock, Thread
+from concurrent.futures import Executor
+import asyncio
+import copy
+import functools
+from collections import OrderedDict
 import gc
+import importlib.util
 import os
+import re
+import uuid
 from dotenv import load_dotenv
 import openai
 
+from bot_prompts import get_bot_prompt, get_proactive_response
+
 # Load environment variables
 load_dotenv()
 
+_STYLE_INSTRUCTIONS = {
+    "creative": "Write in a creative and imaginative style:",
+    "formal": "Write in a formal and professional style:",
+    "casual": "Write in a casual and conversational style:",
+    "academic": "Write in an academic and scholarly style:",
+    "poetic": "Write in a poetic and artistic style:"
+}
+
+# Sampling settings for chat turns
+_CHAT_SAMPLING = {"max_new_tokens": 150, "temperature": 0.8, "top_p": 0.9}
+
+# Reply used when the model output is empty
+_EMPTY_REPLY = "Hello! I'm here to chat with you. How can I help?"
+
+# (persona, culture) -> fallback reply template; {msg} is the user message and
+# {friend_reply} a keyword-based friendly remark
+_PERSONA_FORMATS: Dict[Tuple[str, str], str] = {
+    ("friend", "delhi"): "Hey! {friend_reply} What do you think about this? I'm here to support you!",
+    ("friend", "japanese"): "Hello friend! {friend_reply} Please share more of your thoughts with me.",
+    ("friend", "parisian"): "Bonjour mon ami! {friend_reply} I find this quite fascinating!",
+    ("friend", "berlin"): "Hey there! {friend_reply} Let's talk about this honestly.",
+    ("mentor", "delhi"): "I see you're thinking about: '{msg}'. This is a great learning opportunity. What insights have you gained so far?",
+    ("mentor", "japanese"): "Thank you for sharing: '{msg}'. Let's explore this wisdom together mindfully.",
+    ("mentor", "parisian"): "Ah, '{msg}' - how intellectually stimulating! Let me guide you through this thought.",
+    ("mentor", "berlin"): "Good question about '{msg}'. Let's approach this systematically and learn together.",
+    ("romantic", "delhi"): "My dear, when you say '{msg}', it touches my heart. Tell me more about what you're feeling.",
+    ("romantic", "japanese"): "Sweetheart, '{msg}' shows your beautiful mind. I love how you think about things.",
+    ("romantic", "parisian"): "Mon amour, '{msg}' is so poetic. Share more of your beautiful thoughts with me.",
+    ("romantic", "berlin"): "My love, I appreciate you sharing '{msg}' with me. You always make me think.",
+    ("therapist", "delhi"): "Thank you for sharing '{msg}' with me. How does this make you feel? I'm here to listen.",
+    ("therapist", "japanese"): "I hear you saying '{msg}'. Let's explore these feelings together in this safe space.",
+    ("therapist", "parisian"): "You mentioned '{msg}' - that sounds important to you. What emotions are you experiencing?",
+    ("therapist", "berlin"): "When you say '{msg}', I want to understand. Can you tell me more about this honestly?",
+    ("professional", "delhi"): "Regarding '{msg}' - let's analyze this professionally. What are your objectives here?",
+    ("professional", "japanese"): "About '{msg}' - I think we can work on this efficiently. What's our next step?",
+    ("professional", "parisian"): "Concerning '{msg}' - this is an excellent point. How shall we proceed creatively?",
+    ("professional", "berlin"): "About '{msg}' - let's be direct and solution-focused. What do you need to achieve?"
+}
+
+# Keyword groups for _respond_as_friend in priority order, each compiled into one
+# alternation so a group is a single scan; matching is by substring like `word in text`
+_FRIEND_REPLIES = [
+    (re.compile("|".join(map(re.escape, words))), reply)
+    for words, reply in (
+        (("sad", "upset", "worried", "stressed"), "I can hear that you're going through something tough."),
+        (("happy", "excited", "good", "great", "awesome"), "I love hearing positive energy from you!"),
+        (("work", "job", "career"), "Work stuff can be really challenging sometimes."),
+        (("love", "relationship", "partner"), "Relationships are such an important part of life.")
+    )
+]
+
+# A prompt is a string or a list of segments (history turns, then the new text);
+# all but the last segment are tokenized once and reused across requests
+Prompt = Union[str, List[str]]
+
+# Prompt prefixes longer than _PREFIX_MAX_TOKENS are prefilled per request
+# instead of cached; cached prefixes hold at most _PREFIX_CACHE_TOKENS of KV in
+# total, least recently used evicted first
+_PREFIX_MAX_TOKENS = 256
+_PREFIX_CACHE_TOKENS = 8192
+
+# Conversation turns longer than this are tokenized on every request instead of
+# cached, which bounds _encode_segment at roughly 4096 turns of this size
+_SEGMENT_CACHE_MAX_CHARS = 2048
+
+# Upper bound on prompt + generated tokens held in a preallocated StaticCache
+_STATIC_CACHE_LEN = 2048
+
+# KV_CACHE_QUANT value -> (QuantizedCache backend, bits)
+_KV_CACHE_QUANT_BACKENDS = {
+    "int8": ("hqq", 8),
+    "int4": ("quanto", 4)
+}
+
+class _StopOnEvent(StoppingCriteria):
+    """Stop generate() once `event` is set, e.g. when a streaming client disconnects."""
+
+    def __init__(self, event: Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
 class GemmaHandler:
-    def __init__(self, model_name: str = "microsoft/DialoGPT-small"):
-        """
-        Initialize the Gemma handler with the specified model.
-        """
+    # Whether the backend schedules concurrent requests per decode step itself,
+    # taking them one by one through the *_async methods
+    continuous_batching = False
+
+    def __init__(self, model_name: str = "microsoft/DialoGPT-small", quantization: Optional[str] = None):
+        """Initialize the Gemma handler with the specified model and optional "nf4", "int4" or "int8" quantization."""
         self.model_name = model_name
         self.tokenizer = None
         self.model = None
-        self.device = "cpu"  # Force CPU for reliability
+        self.device = self._default_device()
+        self.quantization = quantization or os.getenv("QUANTIZATION")
+        # Opt-in KV cache quantization ("int8" or "int4"), trading prefix/static cache reuse for KV memory
+        self.kv_cache_quant = os.getenv("KV_CACHE_QUANT")
         self.logger = logging.getLogger(__name__)
         self.hf_token = os.getenv("HUGGINGFACE_TOKEN")
-        
+        # Static prompt prefix -> its token ids, and the KV cache after prefilling them
+        self._prefix_ids: Dict[str, torch.Tensor] = {}
+        self._prefix_kv_cache: "OrderedDict[str, DynamicCache]" = OrderedDict()
+        # Token ids of other static prefixes (text generation, uncached pairs), tokenized once
+        self._encode_prefix = functools.lru_cache(maxsize=64)(self._tokenize_prefix)
+        # Token ids of short conversation turns, which clients resend on every request
+        self._encode_segment = functools.lru_cache(maxsize=4096)(self._tokenize_segment)
+        # Static prompt prefixes only depend on their arguments; returning the same
+        # str object also keeps its hash cached for the prefix dict lookups
+        self._chat_prefix = functools.lru_cache(maxsize=64)(self._build_chat_prefix)
+        self._text_prefix = functools.lru_cache(maxsize=256)(self._build_text_prefix)
+        # Preallocated StaticCache per batch size (num_beams), reset on every call
+        self._static_caches: Dict[int, StaticCache] = {}
+        self._generation_lock = Lock()
+        self._compile_decode = False
+        self._compiled_forward = None
+        if self.device == "cpu":
+            self._configure_cpu_threads()
+
+    def _default_device(self) -> str:
+        """Device to run the model on, from GEMMA_DEVICE."""
+        return os.getenv("GEMMA_DEVICE", "cpu")  # CPU by default for reliability
+
+    def _configure_cpu_threads(self) -> None:
+        """Cap torch's intra-op threads to the CPU affinity mask and turn off inter-op parallelism."""
+        torch.backends.mkldnn.enabled = True
+        if not (os.getenv("OMP_NUM_THREADS") or os.getenv("MKL_NUM_THREADS")) and hasattr(os, "sched_getaffinity"):
+            torch.set_num_threads(min(torch.get_num_threads(), len(os.sched_getaffinity(0))))
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # can only be set once per process, e.g. not again on /reload-model
+
     def load_model(self) -> bool:
         """
         Load the Gemma model and tokenizer.
         """
         try:
-            self.logger.info(f"Loading model: {self.model_name} on device: {self.device}")
+            self.logger.info("Loading model: %s on device: %s", self.model_name, self.device)
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.model_name,
-                trust_remote_code=True
+                trust_remote_code=True,
+                padding_side="left"  # decoder-only batches must be left-padded
             )
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
+            load_kwargs = self._quantization_kwargs()
             self.model = AutoModelForCausalLM.from_pretrained(
                 self.model_name,
-                torch_dtype=torch.float32,
+                torch_dtype=self._select_dtype(),
+                attn_implementation=self._attn_implementation(),
                 trust_remote_code=True,
-                low_cpu_mem_usage=True
+                low_cpu_mem_usage=True,
+                **load_kwargs
             )
-            if self.device == "cpu":
+            if "device_map" not in load_kwargs:
                 self.model = self.model.to(self.device)
+            self.model.eval()
+            self._apply_torchao_quantization()
+            self._apply_ipex()
+            self._configure_compile()
             self.logger.info("Model loaded successfully")
             return True
         except Exception as e:
-            self.logger.error(f"Failed to load model: {str(e)}")
+            self.logger.error("Failed to load model: %s", e)
             return False
 
+    def _select_dtype(self) -> torch.dtype:
+        """Pick the narrowest weight dtype the device runs natively."""
+        if self.device.startswith("cuda") and torch.cuda.is_available():
+            return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        if self.device == "cpu":
+            # bf16 is only fast with AMX / AVX512_BF16; emulated it is far slower than fp32
+            cpu = torch.cpu
+            amx = getattr(cpu, "_is_amx_tile_supported", lambda: False)()
+            avx512_bf16 = getattr(cpu, "_is_avx512_bf16_supported", lambda: False)()
+            if amx or avx512_bf16:
+                return torch.bfloat16
+        return torch.float32
+
+    def _attn_implementation(self) -> str:
+        """FlashAttention-2 where the GPU, dtype and flash-attn allow it, otherwise PyTorch SDPA."""
+        if not (self.device.startswith("cuda") and torch.cuda.is_available()):
+            return "sdpa"
+        torch.backends.cuda.enable_flash_sdp(True)
+        torch.backends.cuda.enable_mem_efficient_sdp(True)
+        if (
+            torch.cuda.get_device_capability() >= (8, 0)
+            and self._select_dtype() in (torch.float16, torch.bfloat16)
+            and importlib.util.find_spec("flash_attn") is not None
+        ):
+            return "flash_attention_2"
+        return "sdpa"
+
+    def _apply_ipex(self) -> None:
+        """Optimize the model with Intel Extension for PyTorch on CPU, if it is installed."""
+        if self.device != "cpu" or self.quantization or importlib.util.find_spec("intel_extension_for_pytorch") is None:
+            return
+        import intel_extension_for_pytorch as ipex
+        self.model = ipex.optimize(
+            self.model, dtype=torch.bfloat16 if self.model.dtype == torch.bfloat16 else None
+        )
+        self.logger.info("Optimized model with Intel Extension for PyTorch")
+
+    def _configure_compile(self) -> None:
+        """Compile the decode step, by default on CUDA and with TORCH_COMPILE=1 on CPU."""
+        on_cuda = self.device.startswith("cuda") and torch.cuda.is_available()
+        if on_cuda:
+            self._compile_decode = torch.__version__ >= "2.3" and os.getenv("TORCH_COMPILE", "1") != "0"
+        else:
+            self._compile_decode = self.device == "cpu" and os.getenv("TORCH_COMPILE") == "1"
+        if not self._compile_decode or not on_cuda:
+            self.model.generation_config.disable_compile = True
+        if not self._compile_decode:
+            return
+        if not on_cuda:
+            import torch._inductor.config as inductor_config
+            inductor_config.freezing = True  # same as TORCHINDUCTOR_FREEZING=1
+            self._compiled_forward = torch.compile(
+                self.model.forward, backend="inductor", mode="max-autotune", dynamic=False
+            )
+            self.logger.info("Decode step will be compiled with Inductor (max-autotune, frozen weights)")
+            return
+        from transformers import CompileConfig
+        self.model.generation_config.compile_config = CompileConfig(
+            mode="reduce-overhead", fullgraph=True, dynamic=False
+        )
+        self._compiled_forward = torch.compile(
+            self.model.forward, mode="reduce-overhead", fullgraph=True, dynamic=False
+        )
+        self.logger.info("Decode step will be compiled with torch.compile(mode='reduce-overhead')")
+
+    def _quantization_kwargs(self) -> Dict[str, Any]:
+        """Return from_pretrained() kwargs for the configured quantization."""
+        if not self.quantization:
+            return {}
+        if self.quantization in ("int4", "int8"):
+            return {}  # applied after loading, see _apply_torchao_quantization()
+        if self.quantization != "nf4":
+            self.logger.warning("Unknown quantization '%s', loading full precision weights", self.quantization)
+            return {}
+        if not self.device.startswith("cuda"):
+            self.logger.warning("NF4 quantization requires CUDA, loading full precision weights")
+            return {}
+        from transformers import BitsAndBytesConfig
+        return {
+            "quantization_config": BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_quant_type="nf4"
+            ),
+            "device_map": self.device
+        }
+
+    def _apply_torchao_quantization(self) -> None:
+        """Quantize the loaded weights in place with torchao for "int4" / "int8"."""
+        if self.quantization not in ("int4", "int8"):
+            return
+        if self.quantization == "int4" and not (
+            self.device.startswith("cuda") and torch.cuda.is_available()
+            and torch.cuda.get_device_capability() >= (8, 0)
+        ):
+            self.logger.warning("int4 quantization requires a CUDA GPU with sm_80+, keeping full precision weights")
+            return
+        try:
+            from torchao.quantization import quantize_, Int4WeightOnlyConfig, Int8DynamicActivationInt8WeightConfig
+        except ImportError:
+            self.logger.warning("torchao is not installed, keeping full precision weights")
+            return
+        if self.quantization == "int4":
+            config = Int4WeightOnlyConfig(group_size=128)
+        else:
+            config = Int8DynamicActivationInt8WeightConfig()
+        quantize_(self.model, config)
+        self.logger.info("Applied torchao %s quantization", self.quantization)
+
+    def warmup(self) -> None:
+        """Run a dummy chat turn so kernel setup and compilation happen before real traffic."""
+        for _ in range(2 if self._compile_decode else 1):
+            self.chat_response(message="hi", persona="friend", culture="delhi", conversation_history=[])
+        self.logger.info("Model warmed up")
+
+    def build_prefix_cache(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Prefill the chat prompt prefix of each (persona, culture) pair into the prefix KV cache."""
+        with torch.inference_mode():
+            for persona, culture in pairs:
+                self._prefix_kv(self._chat_prefix(persona, culture))
+        self.logger.info("Cached KV for %s prompt prefixes", len(self._prefix_kv_cache))
+
+    def _prefix_kv(self, prefix: str) -> DynamicCache:
+        """KV cache of a prompt prefix, prefilled on first use and kept if it is short enough."""
+        prefix_kv = self._prefix_kv_cache.get(prefix)
+        if prefix_kv is not None:
+            self._prefix_kv_cache.move_to_end(prefix)
+            return prefix_kv
+        prefix_ids = self._encode_prefix(prefix)
+        prefix_kv = self.model(prefix_ids, past_key_values=DynamicCache(), use_cache=True).past_key_values
+        if prefix_ids.shape[-1] > _PREFIX_MAX_TOKENS:
+            return prefix_kv
+        self._prefix_ids[prefix] = prefix_ids
+        self._prefix_kv_cache[prefix] = prefix_kv
+        while sum(ids.shape[-1] for ids in self._prefix_ids.values()) > _PREFIX_CACHE_TOKENS:
+            evicted, _ = self._prefix_kv_cache.popitem(last=False)
+            del self._prefix_ids[evicted]
+        return prefix_kv
+
     def generate_response(
         self, 
-        prompt: str, 
+        prompt: Prompt, 
         max_new_tokens: int = 512, 
         temperature: float = 0.7,
         top_p: float = 0.9,
         top_k: int = 50,
-        do_sample: bool = True
+        do_sample: bool = True,
+        prefix: str = ""
     ) -> Optional[str]:
-        """
-        Generate a response using the DialoGPT model.
-        """
+        """Generate a response using the DialoGPT model, or None if generation fails."""
         if not self.model or not self.tokenizer:
             self.logger.error("Model not loaded. Call load_model() first.")
             return None
         try:
-            formatted_prompt = f"{prompt}{self.tokenizer.eos_token}"
-            encoded = self.tokenizer(
-                formatted_prompt + self.tokenizer.eos_token,
-                return_tensors="pt",
-                padding=True
-            )
-            inputs = encoded["input_ids"].to(self.device)
-            attention_mask = encoded["attention_mask"].to(self.device)
-            with torch.no_grad():
+            # Beam search only when decoding greedily; sampling already diversifies
+            num_beams = 1 if do_sample else 3
+            with self._generation_lock, torch.inference_mode():
+                inputs, attention_mask, past_key_values = self._prepare_inputs(
+                    prompt, prefix, num_beams, max_new_tokens=max_new_tokens
+                )
+                if do_sample:
+                    response = self.tokenizer.decode(
+                        self._fast_sample(inputs, past_key_values, max_new_tokens, temperature, top_p, top_k),
+                        skip_special_tokens=True
+                    ).strip()
+                    if not response or len(response) < 3:
+                        return _EMPTY_REPLY
+                    return response
                 chat_history_ids = self.model.generate(
                     inputs,
                     attention_mask=attention_mask,
+                    past_key_values=past_key_values,
                     max_length=inputs.shape[-1] + max_new_tokens,
-                    num_beams=3,
+                    num_beams=num_beams,
+                    early_stopping=num_beams > 1,
                     temperature=temperature,
                     do_sample=do_sample,
                     top_p=top_p,
@@ -85,8 +370,7 @@ class GemmaHandler:
                     pad_token_id=self.tokenizer.eos_token_id,
                     eos_token_id=self.tokenizer.eos_token_id,
                     repetition_penalty=1.2,
-                    length_penalty=1.0,
-                    no_repeat_ngram_size=3
+                    length_penalty=1.0
                 )
             response = self.tokenizer.decode(
                 chat_history_ids[:, inputs.shape[-1]:][0], 
@@ -94,11 +378,295 @@ class GemmaHandler:
             )
             response = response.strip()
             if not response or len(response.strip()) < 3:
-                return "Hello! I'm here to chat with you. How can I help?"
+                return _EMPTY_REPLY
             return response
         except Exception as e:
-            self.logger.error(f"Error generating response: {str(e)}")
-            return "I'm having trouble generating a response right now. Please try again!"
+            self.logger.error("Error generating response: %s", e)
+            return None
+
+    def _fast_sample(
+        self,
+        input_ids: torch.Tensor,
+        past_key_values,
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repetition_penalty: float = 1.2
+    ) -> torch.Tensor:
+        """Sample one sequence with a minimal decode loop instead of generate(), returning the new token ids."""
+        if past_key_values is None:
+            past_key_values = DynamicCache()
+        # Fixed-shape decode steps can replay the compiled forward's CUDA graphs
+        decode_forward = self.model.forward
+        if self._compiled_forward is not None and isinstance(past_key_values, StaticCache):
+            decode_forward = self._compiled_forward
+        cache_len = int(past_key_values.get_seq_length())
+        seq_len = input_ids.shape[-1]
+        # Stop at the context limit instead of allocating for (and indexing past) it
+        max_positions = getattr(self.model.config, "max_position_embeddings", None)
+        if max_positions:
+            max_new_tokens = max(0, min(max_new_tokens, max_positions - seq_len))
+        logits = self.model(
+            input_ids=input_ids[:, cache_len:],
+            past_key_values=past_key_values,
+            cache_position=torch.arange(cache_len, seq_len, device=self.device),
+            use_cache=True
+        ).logits[:, -1]
+        seen = torch.zeros(logits.shape[-1], dtype=torch.bool, device=self.device)
+        seen[input_ids[0]] = True
+        output_ids = torch.empty(max_new_tokens, dtype=torch.long, device=self.device)
+        eos_token_id = self.tokenizer.eos_token_id
+        for step in range(max_new_tokens):
+            logits = logits.float()
+            logits = torch.where(
+                seen, torch.where(logits < 0, logits * repetition_penalty, logits / repetition_penalty), logits
+            )
+            logits = logits / temperature
+            if top_k > 0:
+                kth_largest = torch.topk(logits, min(top_k, logits.shape[-1])).values[..., -1, None]
+                logits = logits.masked_fill(logits < kth_largest, float("-inf"))
+            if top_p < 1.0:
+                sorted_logits, sorted_indices = logits.sort(dim=-1, descending=True)
+                sorted_probs = sorted_logits.softmax(dim=-1)
+                # Drop tokens once the probability mass before them exceeds top_p
+                sorted_logits = sorted_logits.masked_fill(sorted_probs.cumsum(dim=-1) - sorted_probs > top_p, float("-inf"))
+                logits = logits.scatter(-1, sorted_indices, sorted_logits)
+            next_token = torch.multinomial(logits.softmax(dim=-1), num_samples=1)
+            output_ids[step] = next_token[0, 0]
+            seen[next_token[0]] = True
+            if next_token.item() == eos_token_id or step + 1 == max_new_tokens:
+                return output_ids[:step + 1]
+            logits = decode_forward(
+                input_ids=next_token,
+                past_key_values=past_key_values,
+                cache_position=torch.tensor([seq_len + step], device=self.device),
+                use_cache=True
+            ).logits[:, -1]
+        return output_ids[:0]
+
+    def generate_batch(
+        self,
+        prompts: List[Prompt],
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        do_sample: bool = True,
+        prefixes: Optional[List[str]] = None
+    ) -> List[Optional[str]]:
+        """Generate responses for several prompts in a single left-padded batch."""
+        if not self.model or not self.tokenizer:
+            self.logger.error("Model not loaded. Call load_model() first.")
+            return [None] * len(prompts)
+        try:
+            rows = [
+                self._encode_prompt(prompt, prefix)
+                for prompt, prefix in zip(prompts, prefixes or [""] * len(prompts))
+            ]
+            max_len = max(row.shape[-1] for row in rows)
+            inputs = torch.full((len(rows), max_len), self.tokenizer.pad_token_id, dtype=torch.long, device=self.device)
+            attention_mask = torch.zeros_like(inputs)
+            for i, row in enumerate(rows):
+                inputs[i, max_len - row.shape[-1]:] = row[0]
+                attention_mask[i, max_len - row.shape[-1]:] = 1
+            with torch.inference_mode():
+                output_ids = self.model.generate(
+                    inputs,
+                    attention_mask=attention_mask,
+                    past_key_values=self._quantized_cache(len(rows)),
+                    max_length=inputs.shape[-1] + max_new_tokens,
+                    num_beams=1 if do_sample else 3,
+                    early_stopping=not do_sample,
+                    temperature=temperature,
+                    do_sample=do_sample,
+                    top_p=top_p,
+                    top_k=top_k,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    repetition_penalty=1.2,
+                    length_penalty=1.0
+                )
+            responses = []
+            for response in self.tokenizer.batch_decode(output_ids[:, inputs.shape[-1]:], skip_special_tokens=True):
+                response = response.strip()
+                if not response or len(response) < 3:
+                    response = _EMPTY_REPLY
+                responses.append(response)
+            return responses
+        except Exception as e:
+            self.logger.error("Error generating batch: %s", e)
+            return [None] * len(prompts)
+
+    def stream_response(
+        self,
+        prompt: Prompt,
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        prefix: str = "",
+        executor: Optional[Executor] = None
+    ) -> Iterator[str]:
+        """Yield decoded text chunks as the model generates them; closing the iterator stops generation."""
+        if not self.model or not self.tokenizer:
+            self.logger.error("Model not loaded. Call load_model() first.")
+            return
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancelled = Event()
+        generation_kwargs = dict(
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            do_sample=True,
+            top_p=top_p,
+            top_k=top_k,
+            pad_token_id=self.tokenizer.eos_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+            repetition_penalty=1.2,
+            stopping_criteria=StoppingCriteriaList([_StopOnEvent(cancelled)]),
+            streamer=streamer
+        )
+        args = (streamer, cancelled, prompt, prefix, generation_kwargs)
+        if executor is None:
+            Thread(target=self._generate_into_streamer, args=args, daemon=True).start()
+        else:
+            executor.submit(self._generate_into_streamer, *args)
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            # Stop decoding once the consumer goes away (e.g. the client disconnected)
+            cancelled.set()
+
+    def _generate_into_streamer(
+        self,
+        streamer: TextIteratorStreamer,
+        cancelled: Event,
+        prompt: Prompt,
+        prefix: str,
+        generation_kwargs: Dict[str, Any]
+    ) -> None:
+        """Run generate() for a streamer, ending the stream if generation fails."""
+        if cancelled.is_set():
+            # The consumer left while this call was queued
+            streamer.end()
+            return
+        try:
+            with self._generation_lock, torch.inference_mode():
+                inputs, attention_mask, past_key_values = self._prepare_inputs(prompt, prefix, num_beams=1)
+                self.model.generate(
+                    input_ids=inputs,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    **generation_kwargs
+                )
+        except Exception as e:
+            self.logger.error("Error streaming response: %s", e)
+            streamer.end()
+
+    def _prepare_inputs(self, prompt: Prompt, prefix: str, num_beams: int, max_new_tokens: Optional[int] = None):
+        """Token ids, attention mask and KV cache (seeded with the prefix KV) for `prefix + prompt`."""
+        prefix_kv = self._prefix_kv(prefix) if prefix else None
+        inputs = self._encode_prompt(prompt, prefix)
+        attention_mask = torch.ones_like(inputs)
+        past_key_values = self._quantized_cache(num_beams, prefix_kv)
+        if past_key_values is None and max_new_tokens is not None:
+            # Shared across calls, so callers hold _generation_lock until generation ends
+            past_key_values = self._static_cache(num_beams, inputs.shape[-1] + max_new_tokens, prefix_kv)
+        if past_key_values is None and prefix_kv is not None:
+            # generate() extends the cache in place, so work on a copy
+            past_key_values = copy.deepcopy(prefix_kv)
+            if num_beams > 1:
+                past_key_values.batch_repeat_interleave(num_beams)
+        return inputs, attention_mask, past_key_values
+
+    def _quantized_cache(self, batch_size: int, prefix_kv: Optional[DynamicCache] = None) -> Optional[QuantizedCache]:
+        """A new QuantizedCache seeded with `prefix_kv`, or None if KV_CACHE_QUANT is unset."""
+        if not self.kv_cache_quant:
+            return None
+        if self.kv_cache_quant not in _KV_CACHE_QUANT_BACKENDS:
+            self.logger.warning("Unknown KV_CACHE_QUANT '%s', using an unquantized KV cache", self.kv_cache_quant)
+            self.kv_cache_quant = None
+            return None
+        backend, nbits = _KV_CACHE_QUANT_BACKENDS[self.kv_cache_quant]
+        try:
+            cache = QuantizedCache(backend, self.model.config, nbits=nbits)
+            if prefix_kv is not None:
+                for layer_idx, layer in enumerate(prefix_kv.layers):
+                    cache.update(
+                        layer.keys.repeat_interleave(batch_size, dim=0),
+                        layer.values.repeat_interleave(batch_size, dim=0),
+                        layer_idx
+                    )
+            return cache
+        except Exception as e:
+            # Typically the backend package (hqq / optimum-quanto) is missing
+            self.logger.warning("KV cache quantization unavailable, using an unquantized KV cache: %s", e)
+            self.kv_cache_quant = None
+            return None
+
+    def _static_cache(self, batch_size: int, total_len: int, prefix_kv: Optional[DynamicCache]) -> Optional[StaticCache]:
+        """The reset StaticCache for `batch_size` seeded with `prefix_kv`, or None if it cannot be used."""
+        if not self._compile_decode:
+            return None
+        if not (getattr(self.model, "_can_compile_fullgraph", False) or getattr(self.model, "_supports_static_cache", False)):
+            return None
+        config = self.model.config
+        max_cache_len = min(_STATIC_CACHE_LEN, getattr(config, "max_position_embeddings", _STATIC_CACHE_LEN))
+        if total_len > max_cache_len:
+            return None
+        try:
+            cache = self._static_caches.get(batch_size)
+            if cache is None:
+                cache = StaticCache(config=config, max_cache_len=max_cache_len)
+                self._static_caches[batch_size] = cache
+            cache.reset()
+            if prefix_kv is not None:
+                positions = torch.arange(prefix_kv.get_seq_length(), device=self.device)
+                for layer_idx, layer in enumerate(prefix_kv.layers):
+                    cache.update(
+                        layer.keys.repeat_interleave(batch_size, dim=0),
+                        layer.values.repeat_interleave(batch_size, dim=0),
+                        layer_idx,
+                        {"cache_position": positions}
+                    )
+            return cache
+        except Exception as e:
+            self.logger.warning("StaticCache unavailable, using dynamic cache: %s", e)
+            self._static_caches.pop(batch_size, None)
+            return None
+
+    def _encode_prompt(self, prompt: Prompt, prefix: str = "") -> torch.Tensor:
+        """Token ids for `prefix + prompt` followed by one EOS, reusing cached prefix and segment ids."""
+        prefix_ids = None
+        if prefix:
+            prefix_ids = self._prefix_ids.get(prefix)
+            if prefix_ids is None:
+                prefix_ids = self._encode_prefix(prefix)
+        *segments, prompt = [prompt] if isinstance(prompt, str) else prompt
+        input_ids = torch.cat(
+            [
+                self._encode_segment(segment) if len(segment) <= _SEGMENT_CACHE_MAX_CHARS else self._tokenize_segment(segment)
+                for segment in segments
+            ]
+            + [
+                self._tokenize_segment(prompt),
+                torch.tensor([[self.tokenizer.eos_token_id]])
+            ],
+            dim=-1
+        ).to(self.device, non_blocking=True)
+        if prefix_ids is not None:
+            input_ids = torch.cat([prefix_ids, input_ids], dim=-1)
+        return input_ids
+
+    def _tokenize_segment(self, text: str) -> torch.Tensor:
+        """Token ids of a prompt segment, without special tokens."""
+        return self.tokenizer(text, return_tensors="pt", add_special_tokens=False)["input_ids"]
+
+    def _tokenize_prefix(self, prefix: str) -> torch.Tensor:
+        """Token ids of a static prompt prefix, on the model device."""
+        return self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.device)
 
     def chat_response(
         self,
@@ -110,94 +678,107 @@ class GemmaHandler:
         """
         Generate a chat response with persona and culture context.
         """
-        from bot_prompts import get_persona_prompt
-        persona_prompt = get_persona_prompt(persona, culture)
-        conversation_context = ""
-        if conversation_history:
-            for msg in conversation_history[-3:]:
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                conversation_context += f"{role.capitalize()}: {content}\n"
+        request = self._chat_request(message, persona, culture, conversation_history)
+        self.logger.info("[Prompt to model]: %s%s", request["prefix"], "".join(request["prompt"]))
+        response = self.generate_response(**request)
+        self.logger.info("[Model response]: %s", response)
+        return self._chat_reply(response, message, persona, culture)
+
+    def chat_response_batch(self, requests: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """Generate chat responses for several chat_response() keyword-argument dicts at once."""
+        if len(requests) == 1:
+            return [self.chat_response(**requests[0])]
+        chat_requests = [self._chat_request(**request) for request in requests]
+        self.logger.info("Generating a batch of %s chat responses", len(chat_requests))
+        responses = self.generate_batch(
+            [request["prompt"] for request in chat_requests],
+            prefixes=[request["prefix"] for request in chat_requests],
+            **_CHAT_SAMPLING
+        )
+        return [
+            self._chat_reply(
+                response, request["message"], request.get("persona", "friend"), request.get("culture", "delhi")
+            )
+            for request, response in zip(requests, responses)
+        ]
+
+    def stream_chat_response(
+        self,
+        message: str,
+        persona: str = "friend",
+        culture: str = "delhi",
+        conversation_history: Optional[list] = None,
+        executor: Optional[Executor] = None
+    ) -> Iterator[str]:
+        """Stream a chat response, falling back to the persona template if the model produces nothing."""
+        request = self._chat_request(message, persona, culture, conversation_history)
+        produced_text = False
+        for chunk in self.stream_response(executor=executor, **request):
+            produced_text = produced_text or bool(chunk.strip())
+            yield chunk
+        if not produced_text:
+            yield self._generate_persona_response(message, persona, culture)
+
+    def _chat_request(
+        self,
+        message: str,
+        persona: str = "friend",
+        culture: str = "delhi",
+        conversation_history: Optional[list] = None
+    ) -> Dict[str, Any]:
+        """generate_response() keyword arguments for a chat turn."""
+        return dict(
+            prompt=self._chat_prompt(message, conversation_history),
+            prefix=self._chat_prefix(persona, culture),
+            **_CHAT_SAMPLING
+        )
+
+    def _chat_reply(self, response: Optional[str], message: str, persona: str, culture: str) -> str:
+        """The model's chat response, or the persona template if it is missing or too short."""
+        if not response or len(response.strip()) < 10:
+            self.logger.warning("Model response too short or empty, using template fallback.")
+            return self._generate_persona_response(message, persona, culture)
+        return response
+
+    def _chat_prompt(self, message: str, conversation_history: Optional[list]) -> List[str]:
+        """Build the per-request part of the chat prompt: one segment per recent turn, then the new message."""
+        segments = [
+            f"{msg.get('role', 'user').capitalize()}: {msg.get('content', '')}\n"
+            for msg in (conversation_history or [])[-3:]
+        ]
+        segments.append(f"User: {message}\nAssistant:")
+        return segments
+
+    def _build_chat_prefix(self, persona: str, culture: str) -> str:
+        """Build the static part of the chat prompt for a persona and culture."""
         example_user = "I love ice cream"
         example_assistant = self._generate_persona_response(example_user, persona, culture)
-        full_prompt = (
+        return (
             f"You are acting as a {persona} from {culture.title()}.\n"
             f"Respond to the user in a way that reflects this persona and culture. "
             f"Be warm, informal, and use local expressions if possible.\n\n"
             f"Example:\n"
             f"User: {example_user}\n"
             f"Assistant: {example_assistant}\n\n"
-            f"{conversation_context}User: {message}\nAssistant:"
-        )
-        self.logger.info(f"[Prompt to model]: {full_prompt}")
-        response = self.generate_response(
-            full_prompt,
-            max_new_tokens=150,
-            temperature=0.8,
-            top_p=0.9
         )
-        self.logger.info(f"[Model response]: {response}")
-        if not response or len(response.strip()) < 10:
-            self.logger.warning("Model response too short or empty, using template fallback.")
-            response = self._generate_persona_response(message, persona, culture)
-        return response
 
     def _generate_persona_response(self, message: str, persona: str, culture: str) -> str:
         """Generate dynamic responses based on persona and culture for ANY message."""
-        from bot_prompts import get_persona_prompt
-        persona_context = get_persona_prompt(persona, culture)
-        persona_styles = {
-            "friend": {
-                "delhi": lambda msg: f"Hey! {self._respond_as_friend(msg)} What do you think about this? I'm here to support you!",
-                "japanese": lambda msg: f"Hello friend! {self._respond_as_friend(msg)} Please share more of your thoughts with me.",
-                "parisian": lambda msg: f"Bonjour mon ami! {self._respond_as_friend(msg)} I find this quite fascinating!",
-                "berlin": lambda msg: f"Hey there! {self._respond_as_friend(msg)} Let's talk about this honestly."
-            },
-            "mentor": {
-                "delhi": lambda msg: f"I see you're thinking about: '{msg}'. This is a great learning opportunity. What insights have you gained so far?",
-                "japanese": lambda msg: f"Thank you for sharing: '{msg}'. Let's explore this wisdom together mindfully.",
-                "parisian": lambda msg: f"Ah, '{msg}' - how intellectually stimulating! Let me guide you through this thought.",
-                "berlin": lambda msg: f"Good question about '{msg}'. Let's approach this systematically and learn together."
-            },
-            "romantic": {
-                "delhi": lambda msg: f"My dear, when you say '{msg}', it touches my heart. Tell me more about what you're feeling.",
-                "japanese": lambda msg: f"Sweetheart, '{msg}' shows your beautiful mind. I love how you think about things.",
-                "parisian": lambda msg: f"Mon amour, '{msg}' is so poetic. Share more of your beautiful thoughts with me.",
-                "berlin": lambda msg: f"My love, I appreciate you sharing '{msg}' with me. You always make me think."
-            },
-            "therapist": {
-                "delhi": lambda msg: f"Thank you for sharing '{msg}' with me. How does this make you feel? I'm here to listen.",
-                "japanese": lambda msg: f"I hear you saying '{msg}'. Let's explore these feelings together in this safe space.",
-                "parisian": lambda msg: f"You mentioned '{msg}' - that sounds important to you. What emotions are you experiencing?",
-                "berlin": lambda msg: f"When you say '{msg}', I want to understand. Can you tell me more about this honestly?"
-            },
-            "professional": {
-                "delhi": lambda msg: f"Regarding '{msg}' - let's analyze this professionally. What are your objectives here?",
-                "japanese": lambda msg: f"About '{msg}' - I think we can work on this efficiently. What's our next step?",
-                "parisian": lambda msg: f"Concerning '{msg}' - this is an excellent point. How shall we proceed creatively?",
-                "berlin": lambda msg: f"About '{msg}' - let's be direct and solution-focused. What do you need to achieve?"
-            }
-        }
-        response_generator = persona_styles.get(persona, {}).get(culture)
-        if response_generator:
-            return response_generator(message)
-        else:
+        fmt = _PERSONA_FORMATS.get((persona, culture))
+        if fmt is None:
             return f"Thank you for sharing '{message}' with me. I'd love to hear more about your thoughts on this topic!"
+        friend_reply = self._respond_as_friend(message) if persona == "friend" else ""
+        return fmt.format(msg=message, friend_reply=friend_reply)
 
     def _respond_as_friend(self, message: str) -> str:
         """Generate friendly responses to any message."""
         if "?" in message:
             return "That's a really interesting question!"
-        elif any(word in message.lower() for word in ["sad", "upset", "worried", "stressed"]):
-            return "I can hear that you're going through something tough."
-        elif any(word in message.lower() for word in ["happy", "excited", "good", "great", "awesome"]):
-            return "I love hearing positive energy from you!"
-        elif any(word in message.lower() for word in ["work", "job", "career"]):
-            return "Work stuff can be really challenging sometimes."
-        elif any(word in message.lower() for word in ["love", "relationship", "partner"]):
-            return "Relationships are such an important part of life."
-        else:
-            return "I find what you're saying really interesting."
+        message = message.lower()
+        for pattern, reply in _FRIEND_REPLIES:
+            if pattern.search(message):
+                return reply
+        return "I find what you're saying really interesting."
 
     def generate_text(
         self, 
@@ -210,17 +791,72 @@ class GemmaHandler:
         """
         Generate text based on a prompt, style, persona, and culture.
         """
-        style_prompts = {
-            "creative": "Write in a creative and imaginative style:",
-            "formal": "Write in a formal and professional style:",
-            "casual": "Write in a casual and conversational style:",
-            "academic": "Write in an academic and scholarly style:",
-            "poetic": "Write in a poetic and artistic style:"
-        }
-        style_instruction = style_prompts.get(style, style_prompts["creative"])
+        return self.generate_response(**self._text_request(prompt, style, max_tokens, persona, culture))
+
+    def generate_text_batch(self, requests: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """Generate text for several generate_text() keyword-argument dicts, batching equal sampling settings."""
+        if len(requests) == 1:
+            return [self.generate_text(**requests[0])]
+        text_requests = [self._text_request(**request) for request in requests]
+        groups: Dict[Tuple[float, int], List[int]] = {}
+        for i, request in enumerate(text_requests):
+            groups.setdefault((request["temperature"], request["max_new_tokens"]), []).append(i)
+        responses: List[Optional[str]] = [None] * len(requests)
+        for (temperature, max_new_tokens), indices in groups.items():
+            if len(indices) == 1:
+                responses[indices[0]] = self.generate_response(**text_requests[indices[0]])
+                continue
+            self.logger.info("Generating a batch of %s texts", len(indices))
+            outputs = self.generate_batch(
+                [text_requests[i]["prompt"] for i in indices],
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                prefixes=[text_requests[i]["prefix"] for i in indices]
+            )
+            for i, output in zip(indices, outputs):
+                responses[i] = output
+        return responses
+
+    def stream_text(
+        self,
+        prompt: str,
+        style: str = "creative",
+        max_tokens: int = 512,
+        persona: str = "friend",
+        culture: str = "delhi",
+        executor: Optional[Executor] = None
+    ) -> Iterator[str]:
+        """
+        Stream generated text for a prompt, style, persona, and culture.
+        """
+        yield from self.stream_response(executor=executor, **self._text_request(prompt, style, max_tokens, persona, culture))
+
+    def _text_request(
+        self,
+        prompt: str,
+        style: str = "creative",
+        max_tokens: int = 512,
+        persona: str = "friend",
+        culture: str = "delhi"
+    ) -> Dict[str, Any]:
+        """generate_response() keyword arguments for a text generation request."""
+        return dict(
+            prompt=self._text_prompt(prompt),
+            max_new_tokens=max_tokens,
+            temperature=0.8 if style == "creative" else 0.6,
+            prefix=self._text_prefix(style, persona, culture)
+        )
+
+    def _text_prompt(self, prompt: str) -> str:
+        """Build the per-request part of the text generation prompt."""
+        return f"User: {prompt}\nAssistant:"
+
+    def _build_text_prefix(self, style: str, persona: str, culture: str) -> str:
+        """Build the static part of the text generation prompt for a style, persona, and culture."""
+        style_instruction = _STYLE_INSTRUCTIONS.get(style, _STYLE_INSTRUCTIONS["creative"])
         example_user = "Describe your favorite dessert."
         example_assistant = self._generate_persona_response(example_user, persona, culture)
-        full_prompt = (
+        return (
             f"{style_instruction}\n"
             f"You are acting as a {persona} from {culture.title()}.\n"
             f"Respond in a way that reflects this persona and culture. "
@@ -228,25 +864,26 @@ class GemmaHandler:
             f"Example:\n"
             f"User: {example_user}\n"
             f"Assistant: {example_assistant}\n\n"
-            f"User: {prompt}\nAssistant:"
-        )
-        return self.generate_response(
-            full_prompt,
-            max_new_tokens=max_tokens,
-            temperature=0.8 if style == "creative" else 0.6
         )
 
-    def unload_model(self):
-        """Unload the model to free memory."""
+    def unload_model(self, hard: bool = False):
+        """Unload the model to free memory; hard=True also collects garbage and empties the CUDA cache."""
         if self.model:
             del self.model
             self.model = None
         if self.tokenizer:
             del self.tokenizer
             self.tokenizer = None
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        gc.collect()
+        self._prefix_ids.clear()
+        self._prefix_kv_cache.clear()
+        self._encode_prefix.cache_clear()
+        self._encode_segment.cache_clear()
+        self._static_caches.clear()
+        self._compiled_forward = None
+        if hard:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
         self.logger.info("Model unloaded successfully")
 
     def is_loaded(self) -> bool:
@@ -266,17 +903,223 @@ class GemmaHandler:
         """
         Get a proactive response based on mood, persona, and gender.
         """
-        from bot_prompts import get_proactive_response
         persona_key = f"{persona}_{gender}"
         return get_proactive_response(mood, persona_key)
 
+class VLLMHandler(GemmaHandler):
+    """GemmaHandler backed by vLLM's async engine, which batches requests at every decode step."""
+
+    continuous_batching = True
+
+    def _default_device(self) -> str:
+        """vLLM runs its engine on the GPU; GEMMA_DEVICE only applies to the transformers backend."""
+        return "cuda"
+
+    def load_model(self) -> bool:
+        """
+        Start the vLLM engine for the model.
+        """
+        try:
+            from vllm import AsyncEngineArgs, AsyncLLMEngine
+        except ImportError:
+            self.logger.error("INFERENCE_BACKEND=vllm requires the vllm package")
+            return False
+        try:
+            self.logger.info("Starting vLLM engine for: %s", self.model_name)
+            self.model = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(
+                model=self.model_name,
+                dtype="auto",  # the checkpoint's bf16/fp16, never the fp32 CPU fallback
+                enable_prefix_caching=True,
+                max_num_seqs=64,
+                trust_remote_code=True
+            ))
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, trust_remote_code=True)
+            self.logger.info("Model loaded successfully")
+            return True
+        except Exception as e:
+            self.logger.error("Failed to load model: %s", e)
+            return False
+
+    def unload_model(self, hard: bool = False):
+        """Shut the engine and its worker processes down so a reload does not start a second one."""
+        if self.model:
+            try:
+                self.model.shutdown()
+                from vllm.distributed.parallel_state import destroy_distributed_environment, destroy_model_parallel
+                destroy_model_parallel()
+                destroy_distributed_environment()
+            except Exception as e:
+                self.logger.error("Error shutting down vLLM engine: %s", e)
+        super().unload_model(hard=hard)
+
+    def build_prefix_cache(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """vLLM's automatic prefix caching keeps prompt prefix KV from the first request on."""
+
+    def warmup(self) -> None:
+        """vLLM profiles memory and captures its CUDA graphs while starting the engine."""
+
+    def generate_response(self, *args, **kwargs) -> Optional[str]:
+        """The async engine only serves generate_response_async()."""
+        raise NotImplementedError("VLLMHandler serves requests through its *_async methods")
+
+    def generate_batch(self, *args, **kwargs) -> List[Optional[str]]:
+        """The engine batches concurrent generate_response_async() calls itself."""
+        raise NotImplementedError("VLLMHandler serves requests through its *_async methods")
+
+    def stream_response(self, *args, **kwargs) -> Iterator[str]:
+        """The async engine only serves stream_response_async()."""
+        raise NotImplementedError("VLLMHandler serves requests through its *_async methods")
+
+    async def generate_response_async(
+        self,
+        prompt: Prompt,
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        prefix: str = ""
+    ) -> Optional[str]:
+        """Generate a response with the vLLM engine, or None if generation fails."""
+        try:
+            chunks = self._stream_engine(prompt, max_new_tokens, temperature, top_p, top_k, prefix)
+            response = "".join([chunk async for chunk in chunks]).strip()
+        except Exception as e:
+            self.logger.error("Error generating response: %s", e)
+            return None
+        if not response or len(response) < 3:
+            return _EMPTY_REPLY
+        return response
+
+    async def stream_response_async(
+        self,
+        prompt: Prompt,
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        prefix: str = ""
+    ) -> AsyncIterator[str]:
+        """Yield text chunks as the engine generates them, ending the stream if generation fails."""
+        try:
+            async for chunk in self._stream_engine(prompt, max_new_tokens, temperature, top_p, top_k, prefix):
+                yield chunk
+        except Exception as e:
+            self.logger.error("Error streaming response: %s", e)
+
+    async def _stream_engine(
+        self,
+        prompt: Prompt,
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        prefix: str
+    ) -> AsyncIterator[str]:
+        """Submit one request to the engine and yield its new text after every decode step."""
+        if not self.model or not self.tokenizer:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        from vllm import SamplingParams
+        from vllm.sampling_params import RequestOutputKind
+        sampling_params = SamplingParams(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            max_tokens=max_new_tokens,
+            repetition_penalty=1.2,
+            output_kind=RequestOutputKind.DELTA
+        )
+        text = f"{prefix}{prompt if isinstance(prompt, str) else ''.join(prompt)}{self.tokenizer.eos_token}"
+        request_id = uuid.uuid4().hex
+        try:
+            async for output in self.model.generate(text, sampling_params, request_id=request_id):
+                chunk = output.outputs[0].text
+                if chunk:
+                    yield chunk
+        finally:
+            # Free the sequence's slot at once if the caller stops early (e.g. a client disconnect)
+            await self.model.abort(request_id)
+
+    async def chat_response_async(
+        self,
+        message: str,
+        persona: str = "friend",
+        culture: str = "delhi",
+        conversation_history: Optional[list] = None
+    ) -> str:
+        """Generate a chat response like chat_response()."""
+        response = await self.generate_response_async(
+            **self._chat_request(message, persona, culture, conversation_history)
+        )
+        return self._chat_reply(response, message, persona, culture)
+
+    async def stream_chat_response_async(
+        self,
+        message: str,
+        persona: str = "friend",
+        culture: str = "delhi",
+        conversation_history: Optional[list] = None
+    ) -> AsyncIterator[str]:
+        """Stream a chat response like stream_chat_response()."""
+        produced_text = False
+        async for chunk in self.stream_response_async(
+            **self._chat_request(message, persona, culture, conversation_history)
+        ):
+            produced_text = produced_text or bool(chunk.strip())
+            yield chunk
+        if not produced_text:
+            yield self._generate_persona_response(message, persona, culture)
+
+    async def generate_text_async(
+        self,
+        prompt: str,
+        style: str = "creative",
+        max_tokens: int = 512,
+        persona: str = "friend",
+        culture: str = "delhi"
+    ) -> Optional[str]:
+        """Generate text like generate_text()."""
+        return await self.generate_response_async(**self._text_request(prompt, style, max_tokens, persona, culture))
+
+    async def stream_text_async(
+        self,
+        prompt: str,
+        style: str = "creative",
+        max_tokens: int = 512,
+        persona: str = "friend",
+        culture: str = "delhi"
+    ) -> AsyncIterator[str]:
+        """Stream generated text like stream_text()."""
+        async for chunk in self.stream_response_async(**self._text_request(prompt, style, max_tokens, persona, culture)):
+            yield chunk
+
+
+def create_handler(model_name: str = "microsoft/DialoGPT-small") -> GemmaHandler:
+    """Create the handler for the INFERENCE_BACKEND env var: "hf" (default, transformers) or "vllm"."""
+    backend = os.getenv("INFERENCE_BACKEND", "hf").lower()
+    if backend == "vllm":
+        return VLLMHandler(model_name)
+    if backend != "hf":
+        logging.getLogger(__name__).warning("Unknown INFERENCE_BACKEND '%s', using transformers", backend)
+    return GemmaHandler(model_name)
+
 # --- OpenAI Chat Function ---
 
-def openai_chat_response(message: str, persona: str = "friend", culture: str = "delhi", conversation_history: Optional[list] = None) -> str:
+_openai_client: Optional[openai.AsyncOpenAI] = None
+
+def _get_openai_client() -> openai.AsyncOpenAI:
+    """Return the shared AsyncOpenAI client, created on first use."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=openai.DefaultAsyncHttpxClient(http2=importlib.util.find_spec("h2") is not None)
+        )
+    return _openai_client
+
+async def openai_chat_response(message: str, persona: str = "friend", culture: str = "delhi", conversation_history: Optional[list] = None) -> str:
     """
     Generate a chat response using OpenAI GPT-3.5/4 API.
     """
-    openai.api_key = os.getenv("OPENAI_API_KEY")
     system_prompt = f"You are a {persona} from {culture}. Respond informally, warmly, and use local expressions if possible."
     messages = [{"role": "system", "content": system_prompt}]
     if conversation_history:
@@ -284,7 +1127,7 @@ def openai_chat_response(message: str, persona: str = "friend", culture: str = "
             messages.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
     messages.append({"role": "user", "content": message})
 
-    response = openai.ChatCompletion.create(
+    response = await _get_openai_client().chat.completions.create(
         model="gpt-3.5-turbo",  # or "gpt-4o" if you have access
         messages=messages,
         max_tokens=150,
@@ -293,9 +1136,11 @@ def openai_chat_response(message: str, persona: str = "friend", culture: str = "
     )
     return response.choices[0].message.content.strip()
 
-if __name__ == "__main__":
-    from bot_prompts import get_bot_prompt
+async def openai_chat_response_batch(requests: List[Dict[str, Any]]) -> List[str]:
+    """Generate OpenAI chat responses for several requests concurrently."""
+    return list(await asyncio.gather(*(openai_chat_response(**request) for request in requests)))
 
+if __name__ == "__main__":
     def start_chat(bot_id):
         prompt = get_bot_prompt(bot_id)
         print(prompt)  # Or use the prompt in your LLM call
@@ -0,0 +1,143 @@
+"""
+Scheduler for model calls.
+With the transformers backend, concurrent chat and text generation requests
+are collected for a short window and each kind runs as one batch on a single
+inference thread. Backends with continuous batching (vLLM) get each request as
+soon as it arrives and admit and evict sequences at every decode step.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from starlette.concurrency import iterate_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Request kind -> handler method taking a list of keyword-argument dicts
+_BATCH_METHODS = {
+    "chat": "chat_response_batch",
+    "generate": "generate_text_batch"
+}
+# Request kind -> handler methods taking one request's keyword arguments: the
+# async ones of continuously batching backends, and the streaming ones
+_ASYNC_METHODS = {"chat": "chat_response_async", "generate": "generate_text_async"}
+_STREAM_METHODS = {"chat": "stream_chat_response", "generate": "stream_text"}
+_ASYNC_STREAM_METHODS = {"chat": "stream_chat_response_async", "generate": "stream_text_async"}
+
+class InferenceScheduler:
+    def __init__(self, handler, max_batch_size: int = 8, batch_window_ms: int = 20):
+        """
+        Schedule batched calls on `handler`. Model calls run on a single worker
+        thread so they never block the event loop or contend for the model.
+        """
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.batch_window_ms = batch_window_ms
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemma-inference")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the batch worker on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._worker())
+
+    def stop(self) -> None:
+        """
+        Stop the batch worker, failing requests that have not run yet, and shut
+        down the inference thread once its current call returns.
+        """
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        while self._queue and not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            _fail(future, RuntimeError("Inference scheduler stopped"))
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def submit(self, kind: str, **kwargs) -> Any:
+        """Queue a "chat" or "generate" request and wait for its result."""
+        if kind not in _BATCH_METHODS:
+            raise ValueError(f"Unknown request kind '{kind}'")
+        if self._task is None:
+            raise RuntimeError("Inference scheduler is not running")
+        if self.handler.continuous_batching:
+            # The engine admits the request at its next decode step, so skip the batching window
+            return await getattr(self.handler, _ASYNC_METHODS[kind])(**kwargs)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kind, kwargs, future))
+        return await future
+
+    async def stream(self, kind: str, **kwargs) -> AsyncIterator[str]:
+        """Stream a "chat" or "generate" request's text; closing the iterator stops its generation."""
+        if kind not in _STREAM_METHODS:
+            raise ValueError(f"Unknown request kind '{kind}'")
+        if self._task is None:
+            raise RuntimeError("Inference scheduler is not running")
+        if self.handler.continuous_batching:
+            async for chunk in getattr(self.handler, _ASYNC_STREAM_METHODS[kind])(**kwargs):
+                yield chunk
+            return
+        chunks = getattr(self.handler, _STREAM_METHODS[kind])(executor=self._executor, **kwargs)
+        try:
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+        finally:
+            chunks.close()
+
+    async def run(self, func, *args) -> Any:
+        """Run an arbitrary model call on the inference thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _worker(self) -> None:
+        """Collect requests for up to batch_window_ms, then run each kind as one batch."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.batch_window_ms / 1000
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                by_kind: Dict[str, List[Tuple[Dict[str, Any], asyncio.Future]]] = {}
+                for kind, kwargs, future in batch:
+                    by_kind.setdefault(kind, []).append((kwargs, future))
+                for kind, requests in by_kind.items():
+                    await self._run_batch(kind, requests)
+        except asyncio.CancelledError:
+            for _, _, future in batch:
+                _fail(future, RuntimeError("Inference scheduler stopped"))
+            raise
+
+    async def _run_batch(self, kind: str, requests: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        """Run one batch of a single kind and resolve its futures."""
+        try:
+            results = await self.run(self._call_batch, kind, [kwargs for kwargs, _ in requests])
+        except Exception as e:
+            logger.error("Error running %s batch: %s", kind, e)
+            for _, future in requests:
+                _fail(future, e)
+            return
+
+        for (_, future), result in zip(requests, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _call_batch(self, kind: str, requests: List[Dict[str, Any]]) -> List[Any]:
+        """Call the batch method on the inference thread, so a handler swapped in by a reload is used."""
+        return getattr(self.handler, _BATCH_METHODS[kind])(requests)
+
+
+def _fail(future: asyncio.Future, error: Exception) -> None:
+    """Fail a request's future unless it already has a result."""
+    if not future.done():
+        future.set_exception(error)
@@ -53,7 +53,9 @@ def main():
             "gemma_api:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            loop="asyncio" if sys.platform == "win32" else "uvloop",
+            http="httptools",
+            workers=int(os.environ.get("WORKERS", 1)),
             log_level="info"
         )
 